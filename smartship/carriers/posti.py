@@ -1,19 +1,58 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 
+import attr
 import requests
+import six
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util import make_headers
+from requests.packages.urllib3.util.retry import Retry
 
+from .. import __version__
 from ..objects import (
-    Agent, Locations, Parcels, PDFConfig, Receiver, Sender, SenderPartners,
-    Service)
+    Agent, LazySchema, Locations, Parcels, PDFConfig, Receiver, Sender,
+    SenderPartners, Service)
 from ..shipments import Shipment
 
+try:
+    from functools import lru_cache
+except ImportError:  # pragma: no cover
+    from backports.functools_lru_cache import lru_cache
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class _ReadOnlyDict(dict):
+    """
+    Dictionary that can't be modified. Copies, pickles and JSON of it are regular dictionaries.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("'%s' object does not support modification" % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def copy(self):
+        return dict(self)
+
+
 CARRIER_CODE = "POSTI"
 CARRIER_DESCRIPTION = "Posti Oy, Paketit ja kuljetusyksiköt"
 
-SERVICES = {
+# Service tables are read-only so that they can't be modified by accident
+SERVICES = _ReadOnlyDict({
     "IT14I": "Posti - Express Business Day parcel (Ulkomaa)",
     "ITKY14I": "Posti - Express Business Day pallet (Ulkomaa)",
     "ITPR": "Posti - Priority Parcel",
@@ -36,9 +75,9 @@ SERVICES = {
     "PO5007": "Posti - Priority-kirje postiennakolla",
     "PO5041": "Posti - Näytelähetys",
     "POF1": "Posti - Rahti",
-}
+})
 
-NATIONAL_SERVICE_KEYS = [
+NATIONAL_SERVICE_KEYS = frozenset([
     "ITPR",
     "PO2102",
     "PO2103",
@@ -54,14 +93,15 @@ NATIONAL_SERVICE_KEYS = [
     "PO5007",
     "PO5041",
     "POF1",
+])
 
-]
-
-NATIONAL_SERVICES = {
+NATIONAL_SERVICES = _ReadOnlyDict({
     key: description
     for (key, description) in SERVICES.items()
     if key in NATIONAL_SERVICE_KEYS
-}
+})
+
+_VALID_SERVICE_IDS = frozenset(SERVICES)
 
 ADDITIONAL_SERVICES = {
     "COD": "Postiennakko",
@@ -130,16 +170,128 @@ VALID_ADDITIONAL_SERVICES = {
 }
 
 LOCATION_SERVICE_API_ENDPOINT = "https://locationservice.posti.com/location"
+LOCATION_SERVICE_TIMEOUT = (3.05, 10)  # (connect, read) in seconds
+
+LOCATION_SERVICE_HEADERS = {
+    # Advertises gzip and deflate, plus br when brotli is installed
+    "Accept-Encoding": make_headers(accept_encoding=True)["accept-encoding"],
+    "Connection": "keep-alive",
+    "User-Agent": "smartship-posti/%s" % (__version__ or "dev"),
+}
+
+_COUNTRY_CODE_RE = re.compile(r"^[A-Z]{2}\Z")
+
+
+def _create_session():
+    session = requests.Session()
+    session.headers.update(LOCATION_SERVICE_HEADERS)
+    # Return the last response once retries run out so that raise_for_status raises an HTTPError as before
+    retries = Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504], raise_on_status=False)
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries))
+    return session
+
+
+def _create_http2_client():
+    # Imported here as HTTP/2 is optional and rarely used
+    try:
+        import h2  # noqa: F401 (needed for HTTP/2 support in httpx)
+        import httpx
+    except ImportError:
+        raise ImportError("HTTP/2 support requires httpx[http2], install smartship[http2]")
+    # The limits must be given to the transport, since httpx ignores the client's limits with a custom transport
+    return httpx.Client(
+        http2=True,
+        transport=httpx.HTTPTransport(
+            http2=True, retries=3, limits=httpx.Limits(max_keepalive_connections=4, max_connections=20)),
+        timeout=httpx.Timeout(10.0, connect=3.05),
+        headers={"User-Agent": LOCATION_SERVICE_HEADERS["User-Agent"]},
+    )
+
+
+# Shared between calls so that connections to the location service are kept alive and reused. The HTTP/2 client
+# that multiplexes concurrent requests over a single connection is only used once enabled with `use_http2`.
+_SESSION = _create_session()
+_HTTP2_CLIENT = None
+
+
+@attr.s
+class CacheStats(object):
+    hits = attr.ib(default=0)
+    misses = attr.ib(default=0)
+
+
+# Location data changes slowly, so identical queries are answered from memory for a while
+_LOCATIONS_CACHE = TTLCache(maxsize=1024, ttl=600)
+_LOCATIONS_CACHE_LOCK = threading.RLock()
+_LOCATIONS_CACHE_STATS = CacheStats()
+
+
+def set_session(session):
+    """
+    Replace the HTTP session used for location service requests.
+
+    The given session is used instead of the HTTP/2 client even if it has been enabled with `use_http2`.
+
+    :param session: Session to use, for example a customized or mocked ``requests.Session``
+    :type session: requests.Session
+    """
+    global _SESSION, _HTTP2_CLIENT
+    _SESSION = session
+    if _HTTP2_CLIENT is not None:
+        _HTTP2_CLIENT.close()
+    _HTTP2_CLIENT = None
+
+
+def use_http2(enabled=True):
+    """
+    Send location service requests over HTTP/2 using httpx instead of the requests session.
+
+    Requires httpx with HTTP/2 support (``pip install smartship[http2]``). Note that HTTP and connection errors
+    are then raised as httpx exceptions instead of requests exceptions. Proxies configured in the environment (for
+    example ``HTTPS_PROXY``) are not supported with HTTP/2.
+
+    :param enabled: Whether to use HTTP/2. Default value is True.
+    :type enabled: bool
+    :raises: ImportError: if httpx with HTTP/2 support is not installed
+    """
+    global _HTTP2_CLIENT
+    client = _create_http2_client() if enabled else None
+    if _HTTP2_CLIENT is not None:
+        _HTTP2_CLIENT.close()
+    _HTTP2_CLIENT = client
+
+
+# The schema variants copy only the parts they change and share the rest with the base schema
+def _build_mobile_receiver_schema():
+    schema = dict(Receiver.schema)
+    schema["oneOf"] = [{"required": ["name", "city", "country", "mobile"]}] + list(Receiver.schema["oneOf"][1:])
+    return schema
+
+
+def _build_weighted_parcels_schema():
+    schema = dict(Parcels.schema)
+    items = dict(schema["items"])
+    items["required"] = list(items["required"]) + ["weight"]
+    schema["items"] = items
+    return schema
 
 
 class MobileReceiver(Receiver):
-    schema = deepcopy(Receiver.schema)
-    schema["oneOf"][0] = {"required": ["name", "city", "country", "mobile"]}
+    schema = LazySchema(_build_mobile_receiver_schema)
 
 
 class WeightedParcels(Parcels):
-    schema = deepcopy(Parcels.schema)
-    schema["items"]["required"].append("weight")
+    schema = LazySchema(_build_weighted_parcels_schema)
+
+
+# Services that always need a more specific receiver or parcels class
+_RECEIVER_CLASSES = {
+    "PO2104": MobileReceiver,
+}
+
+_PARCELS_CLASSES = {
+    "PO5041": WeightedParcels,
+}
 
 
 def create_shipment(
@@ -212,26 +364,26 @@ def create_shipment(
     receiver_class = _infer_receiver_class(service_id, agent)
     parcels_class = _infer_parcels_class(service_id)
 
-    kwargs = {
-        "sender": Sender(sender),
-        "senderPartners": SenderPartners([{"id": CARRIER_CODE, "custNo": custno}]),
-        "receiver": receiver_class(receiver),
-        "parcels": parcels_class(parcels),
-        "service": _build_service(addons, service_id),
-    }
-    if agent:
-        kwargs["agent"] = Agent(agent)
-    if order_no:
-        kwargs["orderNo"] = order_no
-    if sender_reference:
-        kwargs["senderReference"] = sender_reference
-    if receiver_reference:
-        kwargs["receiverReference"] = receiver_reference
-    if pdf_config:
-        kwargs["pdfConfig"] = PDFConfig(pdf_config)
-    if free_text:
-        kwargs["freeText1"] = free_text
-    return Shipment(**kwargs)
+    # Unset optional values are passed as the Shipment defaults, which are left out of the built data
+    return Shipment(
+        sender=Sender(sender),
+        senderPartners=deepcopy(_sender_partners_for(custno)),
+        receiver=receiver_class(receiver),
+        parcels=parcels_class(parcels),
+        service=_build_service(addons, service_id),
+        agent=Agent(agent or None),
+        orderNo=order_no or None,
+        senderReference=sender_reference or "",
+        receiverReference=receiver_reference or "",
+        pdfConfig=PDFConfig(pdf_config or None),
+        freeText1=free_text or "",
+    )
+
+
+@lru_cache(maxsize=64)
+def _sender_partners_for(custno):
+    # Validating the partners is far more expensive than copying an already validated instance
+    return SenderPartners([{"id": CARRIER_CODE, "custNo": custno}])
 
 
 def _build_service(addons, service_id):
@@ -242,30 +394,34 @@ def _build_service(addons, service_id):
 
 
 def _validate_create_shipment(service_id):
-    if service_id not in SERVICES:
+    if service_id not in _VALID_SERVICE_IDS:
         raise ValueError("Invalid 'service_id'.")
 
 
 def _infer_receiver_class(service_id, agent):
-    if service_id == "PO2104":
-        return MobileReceiver
+    receiver_class = _RECEIVER_CLASSES.get(service_id)
+    if receiver_class:
+        return receiver_class
     if service_id == "PO2103" and agent:
         return MobileReceiver
     return Receiver
 
 
 def _infer_parcels_class(service_id):
-    if service_id == "PO5041":
-        return WeightedParcels
-    return Parcels
+    return _PARCELS_CLASSES.get(service_id, Parcels)
 
 
 def get_locations(
         country_code=None, top=None,
         types=None, lattitude=None, longitude=None, distance=None, bounding_box=None,
         zipcode=None, location_zipcode=None, strict_zip_code=None, city=None, municipality=None,
-        pup_code=None, partner_type=None):
+        pup_code=None, partner_type=None, use_cache=True):
     """
+    Find Posti locations (pickup points, post offices etc.) from the Posti location service.
+
+    Results are cached in memory for a while. Use ``get_locations.cache_clear()`` to empty the cache and
+    ``get_locations.cache_info()`` to see its hit and miss counts.
+
     :param country_code: Limits results to given county. Default value is FI (Finland)
     :type country_code: str
     :param top: Amount of locations to return. API returns this amount of closest locations
@@ -299,36 +455,197 @@ def get_locations(
     :param partner_type: Filter results based on partner type. Allowed types: "POSTI", "AIBE", "BOXNET",
         "TOPO_CENTRAS".
     :type partner_type: str
+    :param use_cache: Whether to use cached results for the same query if available. Default value is True.
+    :type use_cache: bool
+    :return: Locations
+    :raises: ValueError: if the query is not valid for the location service
     """
+    params = _build_location_params(
+        country_code=country_code, top=top, types=types, lattitude=lattitude, longitude=longitude,
+        distance=distance, bounding_box=bounding_box, zipcode=zipcode, location_zipcode=location_zipcode,
+        strict_zip_code=strict_zip_code, city=city, municipality=municipality, pup_code=pup_code,
+        partner_type=partner_type,
+    )
+    if not use_cache:
+        return _fetch_locations(params)
+
+    key = _locations_cache_key(params)
+    locations = _get_cached_locations(key)
+    if locations is None:
+        locations = _fetch_locations(params)
+        _cache_locations(key, locations)
+    # Hand out a copy so that modifications by the caller don't end up in the cache
+    return deepcopy(locations)
+
+
+def get_locations_bulk(queries, max_workers=8, use_cache=True):
+    """
+    Find Posti locations for several queries at once.
+
+    Queries are sent to the location service concurrently. Identical queries are only sent once and cached
+    results are used when available.
+
+    Example usage:
+        locations_list = get_locations_bulk([
+            {"country_code": "FI", "zipcode": "00120"},
+            {"country_code": "FI", "zipcode": "20100"},
+        ])
+
+    :param queries: Queries as dictionaries of `get_locations` keyword arguments.
+    :type queries: list[dict]
+    :param max_workers: Maximum amount of concurrent requests to the location service.
+    :type max_workers: int
+    :param use_cache: Whether to use cached results for the same query if available. Default value is True.
+    :type use_cache: bool
+    :return: Locations for each query, in the same order as the queries
+    :rtype: list[smartship.objects.Locations]
+    """
+    params_list = [_build_location_params(**query) for query in queries]
+    keys = [_locations_cache_key(params) for params in params_list]
+
+    results = {}
+    pending = {}
+    for key, params in zip(keys, params_list):
+        if key in results or key in pending:
+            continue
+        locations = _get_cached_locations(key) if use_cache else None
+        if locations is not None:
+            results[key] = locations
+        else:
+            pending[key] = params
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            futures = {
+                key: executor.submit(_fetch_locations, params)
+                for (key, params) in pending.items()
+            }
+        # Cache every successful result before raising the first error, so that a retry only fetches the rest
+        error = None
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if use_cache:
+                _cache_locations(key, results[key])
+        if error is not None:
+            raise error
+
+    return [deepcopy(results[key]) for key in keys]
+
+
+def _build_location_params(
+        country_code=None, top=None,
+        types=None, lattitude=None, longitude=None, distance=None, bounding_box=None,
+        zipcode=None, location_zipcode=None, strict_zip_code=None, city=None, municipality=None,
+        pup_code=None, partner_type=None):
     params = {
-        "countryCode": country_code,
-        "top": top,
-        "types": types,
-        "lat": lattitude,
-        "lng": longitude,
-        "distance": distance,
-        "zipCode": zipcode,
-        "locationZipCode": location_zipcode,
-        "strictZipCode": "true" if strict_zip_code else None,
-        "city": city,
-        "municipality": municipality,
-        "pupCode": pup_code,
-        "partnerType": partner_type,
+        key: value
+        for (key, value) in (
+            ("countryCode", country_code),
+            ("top", top),
+            ("types", types),
+            ("lat", lattitude),
+            ("lng", longitude),
+            ("distance", distance),
+            ("zipCode", zipcode),
+            ("locationZipCode", location_zipcode),
+            ("strictZipCode", "true" if strict_zip_code else None),
+            ("city", city),
+            ("municipality", municipality),
+            ("pupCode", pup_code),
+            ("partnerType", partner_type),
+        )
+        if value is not None
     }
+    _validate_location_query(params, bounding_box)
 
     if bounding_box is not None:
         params["topLeftLat"] = bounding_box[0]
         params["topLeftLng"] = bounding_box[1]
         params["bottomRightLat"] = bounding_box[2]
         params["bottomRightLng"] = bounding_box[3]
+    return params
+
+
+def _validate_location_query(params, bounding_box):
+    # Catch queries the location service would reject before making a request
+    if ("lat" in params or "lng" in params) and "top" not in params and "distance" not in params:
+        raise ValueError("Either 'top' or 'distance' is required with 'lattitude' and 'longitude'")
+    if "countryCode" in params:
+        country_code = params["countryCode"]
+        if not isinstance(country_code, six.string_types) or not _COUNTRY_CODE_RE.match(country_code):
+            raise ValueError("Invalid 'country_code', expected a two letter country code")
+    if bounding_box is not None:
+        try:
+            if len(bounding_box) != 4:
+                raise ValueError()
+            [float(coordinate) for coordinate in bounding_box]
+        except (TypeError, ValueError):
+            raise ValueError("'bounding_box' must be a list of four numeric coordinates")
+
+
+def _get_cached_locations(key):
+    with _LOCATIONS_CACHE_LOCK:
+        locations = _LOCATIONS_CACHE.get(key)
+        if locations is None:
+            _LOCATIONS_CACHE_STATS.misses += 1
+        else:
+            _LOCATIONS_CACHE_STATS.hits += 1
+        return locations
+
+
+def _cache_locations(key, locations):
+    with _LOCATIONS_CACHE_LOCK:
+        _LOCATIONS_CACHE[key] = locations
+
+
+def _locations_cache_clear():
+    with _LOCATIONS_CACHE_LOCK:
+        _LOCATIONS_CACHE.clear()
+        _LOCATIONS_CACHE_STATS.hits = 0
+        _LOCATIONS_CACHE_STATS.misses = 0
 
-    for key, value in list(params.items()):
-        if value is None:
-            params.pop(key)
 
-    response = requests.get(LOCATION_SERVICE_API_ENDPOINT, params=params)
+def _locations_cache_info():
+    with _LOCATIONS_CACHE_LOCK:
+        return CacheStats(_LOCATIONS_CACHE_STATS.hits, _LOCATIONS_CACHE_STATS.misses)
+
+
+get_locations.cache_clear = _locations_cache_clear
+get_locations.cache_info = _locations_cache_info
+
+
+def _locations_cache_key(params):
+    return tuple(sorted(
+        (key, _hashable(value))
+        for (key, value) in params.items()
+    ))
+
+
+def _hashable(value):
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return value
+
+
+def _fetch_locations(params):
+    if _HTTP2_CLIENT is not None:
+        response = _HTTP2_CLIENT.get(LOCATION_SERVICE_API_ENDPOINT, params=params)
+    else:
+        response = _SESSION.get(LOCATION_SERVICE_API_ENDPOINT, params=params, timeout=LOCATION_SERVICE_TIMEOUT)
     response.raise_for_status()
-    return Locations(response.json()["locations"])
+    return _parse_locations(response)
+
+
+def _parse_locations(response):
+    # orjson is considerably faster than the json module with large result sets
+    data = orjson.loads(response.content) if orjson is not None else response.json()
+    return Locations(data["locations"])
 
 
 def get_additional_services(service_id):
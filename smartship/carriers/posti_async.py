@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous interface to the Posti location service for asyncio applications.
+
+Requires Python 3.5+ and aiohttp.
+"""
+import asyncio
+import json
+from copy import deepcopy
+
+import aiohttp
+
+from ..objects import Locations
+from .posti import (
+    LOCATION_SERVICE_API_ENDPOINT, LOCATION_SERVICE_HEADERS,
+    _build_location_params, _cache_locations, _get_cached_locations,
+    _locations_cache_key)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+LOCATION_SERVICE_TIMEOUT = 10  # seconds
+
+# Created on first use, as aiohttp sessions must be created inside a running event loop. Sessions and locks
+# can't be used outside the event loop they were created in, so they are recreated when the loop changes.
+_AIO_SESSION = None
+_AIO_SESSION_LOCK = None
+_AIO_SESSION_LOOP = None
+
+
+async def get_locations_async(use_cache=True, **query):
+    """
+    Find Posti locations from the Posti location service without blocking the event loop.
+
+    Example usage:
+        locations = await get_locations_async(country_code="FI", zipcode="00120")
+
+    :param use_cache: Whether to use cached results for the same query if available. Default value is True.
+        The cache is shared with `smartship.carriers.posti.get_locations`.
+    :type use_cache: bool
+    :param query: Query parameters, see `smartship.carriers.posti.get_locations`.
+    :return: Locations
+    """
+    params = _build_location_params(**query)
+    if not use_cache:
+        return await _fetch_locations(params)
+
+    key = _locations_cache_key(params)
+    locations = _get_cached_locations(key)
+    if locations is None:
+        locations = await _fetch_locations(params)
+        _cache_locations(key, locations)
+    # Hand out a copy so that modifications by the caller don't end up in the cache
+    return deepcopy(locations)
+
+
+async def close_async_session():
+    """
+    Close the HTTP session used for asynchronous location service requests.
+
+    Call this when shutting down the event loop. A new session is created if locations are requested again.
+    """
+    global _AIO_SESSION
+    if _AIO_SESSION is not None:
+        if _AIO_SESSION_LOOP is asyncio.get_event_loop():
+            await _AIO_SESSION.close()
+        else:
+            _release_session(_AIO_SESSION)
+    _AIO_SESSION = None
+
+
+async def _get_session():
+    global _AIO_SESSION, _AIO_SESSION_LOCK, _AIO_SESSION_LOOP
+    loop = asyncio.get_event_loop()
+    if _AIO_SESSION_LOOP is not loop:
+        if _AIO_SESSION is not None:
+            _release_session(_AIO_SESSION)
+        _AIO_SESSION = None
+        _AIO_SESSION_LOCK = asyncio.Lock()
+        _AIO_SESSION_LOOP = loop
+    async with _AIO_SESSION_LOCK:
+        if _AIO_SESSION is None or _AIO_SESSION.closed:
+            _AIO_SESSION = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=LOCATION_SERVICE_TIMEOUT),
+                headers={"User-Agent": LOCATION_SERVICE_HEADERS["User-Agent"]},
+            )
+    return _AIO_SESSION
+
+
+def _release_session(session):
+    # The session belongs to another, usually already closed, event loop, so it can't be awaited to close
+    connector = session.connector
+    session.detach()
+    if connector is not None:
+        connector._close()
+
+
+async def _fetch_locations(params):
+    session = await _get_session()
+    async with session.get(LOCATION_SERVICE_API_ENDPOINT, params=_to_query(params)) as response:
+        response.raise_for_status()
+        data = await response.json(loads=orjson.loads if orjson is not None else json.loads)
+    return Locations(data["locations"])
+
+
+def _to_query(params):
+    # aiohttp only accepts string values, and repeated keys have to be given as separate pairs
+    query = []
+    for (key, value) in params.items():
+        for item in (value if isinstance(value, (list, tuple, set, frozenset)) else [value]):
+            query.append((key, str(item)))
+    return query
@@ -9,6 +9,21 @@ from .schemas import (
     PDF_CONFIG_SCHEMA, SERVICE_SCHEMA)
 
 
+class LazySchema(object):
+    """
+    Schema class attribute that is built with the given factory on first access.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._schema = None
+
+    def __get__(self, instance, owner):
+        if self._schema is None:
+            self._schema = self._factory()
+        return self._schema
+
+
 class JSONObject(object):
     schema = {}  # Defined in subclass
 
@@ -1,13 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import json
+import pickle
+import sys
+from copy import copy, deepcopy
+from enum import Enum
+
+import pytest
+import requests
 from jsonschema import ValidationError
 from mock import Mock, patch
 from pytest import raises
 
+from smartship.carriers import posti
 from smartship.carriers.posti import (
-    LOCATION_SERVICE_API_ENDPOINT, create_shipment, get_additional_services,
-    get_locations)
+    LOCATION_SERVICE_API_ENDPOINT, LOCATION_SERVICE_TIMEOUT,
+    NATIONAL_SERVICE_KEYS, NATIONAL_SERVICES, SERVICES, CacheStats,
+    MobileReceiver, WeightedParcels, _create_session, create_shipment,
+    get_additional_services, get_locations, get_locations_bulk, set_session,
+    use_http2)
+from smartship.objects import Parcels, Receiver
 from smartship.shipments import DEFAULT_PDF_CONFIG, Shipment
 
 
@@ -119,6 +132,35 @@ def test_create_more_complex_shipment(mock_validate):
     }
 
 
+@patch("smartship.carriers.posti._validate_create_shipment")
+def test_create_shipment_optional_fields(mock_validate):
+    receiver = {"quickId": "2"}
+    sender = {"quickId": "1"}
+    agent = {"quickId": "3"}
+    shipment = create_shipment(
+        "custno", "service_id", receiver, sender, [{"copies": 1}], agent=agent,
+        receiver_reference="receiver ref", free_text="free text",
+    )
+    shipment.build()
+    assert shipment.data["shipment"]["agent"] == agent
+    assert shipment.data["shipment"]["receiverReference"] == "receiver ref"
+    assert shipment.data["shipment"]["freeText1"] == "free text"
+    assert "orderNo" not in shipment.data["shipment"]
+    assert "senderReference" not in shipment.data["shipment"]
+
+
+@patch("smartship.carriers.posti._validate_create_shipment")
+def test_create_shipments_sender_partners_not_shared(mock_validate):
+    receiver = {"quickId": "2"}
+    sender = {"quickId": "1"}
+    shipment1 = create_shipment("custno", "service_id", receiver, sender, [{"copies": 1}])
+    shipment2 = create_shipment("custno", "service_id", receiver, sender, [{"copies": 1}])
+    shipment1.senderPartners[0]["custNo"] = "other"
+    assert shipment2.senderPartners.get_json() == [{"id": "POSTI", "custNo": "custno"}]
+    shipment3 = create_shipment("custno", "service_id", receiver, sender, [{"copies": 1}])
+    assert shipment3.senderPartners.get_json() == [{"id": "POSTI", "custNo": "custno"}]
+
+
 @patch("smartship.carriers.posti._validate_create_shipment")
 def test_create_invalid_mobile_shipment(mock_validate):
     receiver = {
@@ -179,6 +221,56 @@ def test_create_invalid_parcel_shipment(mock_validate):
     mock_validate.assert_called_once_with("PO5041")
 
 
+def test_create_shipment_invalid_service():
+    with raises(ValueError):
+        create_shipment("custno", "INVALID", {"quickId": "2"}, {"quickId": "1"}, [{"copies": 1}])
+
+
+def test_create_shipment_str_subclass_service():
+    class ServiceId(str, Enum):
+        PO5041 = "PO5041"
+
+    parcels = [{"copies": 1, "weight": 1.5}]
+    shipment = create_shipment("custno", ServiceId.PO5041, {"quickId": "2"}, {"quickId": "1"}, parcels)
+    assert isinstance(shipment.parcels, WeightedParcels)
+    assert shipment.service["id"] == "PO5041"
+
+
+def test_national_services():
+    assert set(NATIONAL_SERVICES) == NATIONAL_SERVICE_KEYS
+    assert NATIONAL_SERVICES["PO2103"] == "Posti - Postipaketti"
+
+
+def test_services_read_only():
+    with raises(TypeError):
+        SERVICES["PO9999"] = "Posti - Invalid"
+    with raises(TypeError):
+        NATIONAL_SERVICES.update({"PO9999": "Posti - Invalid"})
+    with raises(TypeError):
+        del NATIONAL_SERVICES["PO2103"]
+    assert "PO9999" not in SERVICES
+
+
+def test_services_copyable():
+    assert deepcopy(SERVICES) == SERVICES
+    assert copy(NATIONAL_SERVICES) == NATIONAL_SERVICES
+    assert pickle.loads(pickle.dumps(SERVICES)) == SERVICES
+    assert json.loads(json.dumps(NATIONAL_SERVICES)) == NATIONAL_SERVICES
+    services = SERVICES.copy()
+    services["PO9999"] = "Posti - Custom"
+    assert "PO9999" not in SERVICES
+
+
+def test_schema_variants():
+    assert MobileReceiver.schema["oneOf"] == [
+        {"required": ["name", "city", "country", "mobile"]},
+        {"required": ["quickId"]},
+    ]
+    assert Receiver.schema["oneOf"][0] == {"required": ["name", "city", "country"]}
+    assert WeightedParcels.schema["items"]["required"] == ["copies", "weight"]
+    assert Parcels.schema["items"]["required"] == ["copies"]
+
+
 LOCATION = {
     "publicName": {
         "fi": "Posti, Keskusta",
@@ -302,12 +394,191 @@ LOCATION = {
 }
 
 
-@patch("smartship.carriers.posti.requests.get", return_value=Mock(json=lambda: {"locations": [LOCATION]}))
+def locations_response(locations):
+    data = {"locations": locations}
+    return Mock(content=json.dumps(data).encode("utf-8"), json=lambda: data)
+
+
+@patch("smartship.carriers.posti._SESSION.get", return_value=locations_response([LOCATION]))
 def test_get_locations(mock_get):
     locations = get_locations(zipcode="20100")
     assert len(list(locations)) == 1
     assert locations[0]["type"] == "POSTOFFICE"
-    mock_get.assert_called_once_with(LOCATION_SERVICE_API_ENDPOINT, params={"zipCode": "20100"})
+    mock_get.assert_called_once_with(
+        LOCATION_SERVICE_API_ENDPOINT, params={"zipCode": "20100"}, timeout=LOCATION_SERVICE_TIMEOUT)
+
+
+def test_session_retries():
+    retries = _create_session().get_adapter(LOCATION_SERVICE_API_ENDPOINT).max_retries
+    assert retries.total == 3
+    # The final response must reach raise_for_status instead of raising a RetryError
+    assert retries.raise_on_status is False
+
+
+def test_session_headers():
+    session = _create_session()
+    assert "gzip" in session.headers["Accept-Encoding"]
+    assert session.headers["Connection"] == "keep-alive"
+    assert session.headers["User-Agent"].startswith("smartship-posti/")
+
+
+@patch("smartship.carriers.posti._SESSION")
+def test_set_session(mock_default_session):
+    session = Mock()
+    session.get.return_value = locations_response([LOCATION])
+    set_session(session)
+    try:
+        get_locations(zipcode="20100")
+    finally:
+        set_session(mock_default_session)
+    session.get.assert_called_once_with(
+        LOCATION_SERVICE_API_ENDPOINT, params={"zipCode": "20100"}, timeout=LOCATION_SERVICE_TIMEOUT)
+    assert not mock_default_session.get.called
+
+
+@patch("smartship.carriers.posti._SESSION.get", return_value=locations_response([LOCATION]))
+def test_get_locations_cached(mock_get):
+    locations = get_locations(zipcode="20100", types=["POSTOFFICE"])
+    locations[0]["type"] = "LOCKER"
+    cached_locations = get_locations(types=["POSTOFFICE"], zipcode="20100")
+    assert mock_get.call_count == 1
+    assert cached_locations[0]["type"] == "POSTOFFICE"
+    assert get_locations.cache_info() == CacheStats(hits=1, misses=1)
+
+    get_locations(zipcode="20100", types=["POSTOFFICE"], use_cache=False)
+    assert mock_get.call_count == 2
+
+    get_locations.cache_clear()
+    get_locations(zipcode="20100", types=["POSTOFFICE"])
+    assert mock_get.call_count == 3
+    assert get_locations.cache_info() == CacheStats(hits=0, misses=1)
+
+
+@patch("smartship.carriers.posti._SESSION.get", return_value=locations_response([LOCATION]))
+def test_get_locations_params(mock_get):
+    get_locations(country_code="FI", strict_zip_code=False, city="Turku", bounding_box=[60.5, 22.2, 60.4, 22.3])
+    assert mock_get.call_args[1]["params"] == {
+        "countryCode": "FI",
+        "city": "Turku",
+        "topLeftLat": 60.5,
+        "topLeftLng": 22.2,
+        "bottomRightLat": 60.4,
+        "bottomRightLng": 22.3,
+    }
+
+
+@pytest.mark.parametrize("query", [
+    {"lattitude": "60.45", "longitude": "22.26"},
+    {"longitude": "22.26"},
+    {"country_code": "fi"},
+    {"country_code": "FIN"},
+    {"country_code": "FI\n"},
+    {"country_code": 5},
+    {"bounding_box": [60.5, 22.2, 60.4]},
+    {"bounding_box": [60.5, 22.2, 60.4, "east"]},
+    {"bounding_box": [60.5, 22.2, 60.4, None]},
+    {"bounding_box": 5},
+])
+def test_get_locations_invalid_query(query):
+    with patch("smartship.carriers.posti._SESSION.get") as mock_get:
+        with raises(ValueError):
+            get_locations(**query)
+    assert not mock_get.called
+
+
+@patch("smartship.carriers.posti._SESSION.get", return_value=locations_response([LOCATION]))
+def test_get_locations_cached_set_types(mock_get):
+    get_locations(zipcode="20100", types={"POSTOFFICE", "LOCKER"})
+    get_locations(zipcode="20100", types={"LOCKER", "POSTOFFICE"})
+    assert mock_get.call_count == 1
+
+
+def test_get_locations_bulk():
+    def get(url, params, timeout):
+        location = dict(LOCATION, postalCode=params["zipCode"])
+        return locations_response([location])
+
+    with patch("smartship.carriers.posti._SESSION.get", side_effect=get) as mock_get:
+        get_locations(zipcode="00120")
+        mock_get.reset_mock()
+        results = get_locations_bulk([
+            {"zipcode": "20100"},
+            {"zipcode": "00120"},
+            {"zipcode": "33100", "country_code": "FI"},
+            {"zipcode": "20100"},
+        ])
+    assert [locations[0]["postalCode"] for locations in results] == ["20100", "00120", "33100", "20100"]
+    assert results[0] is not results[3]
+    # "00120" is cached and the duplicate "20100" is only fetched once
+    assert mock_get.call_count == 2
+    assert sorted(call[1]["params"]["zipCode"] for call in mock_get.call_args_list) == ["20100", "33100"]
+    assert get_locations(zipcode="33100", country_code="FI")[0]["postalCode"] == "33100"
+
+
+@patch("smartship.carriers.posti._SESSION")
+@patch("smartship.carriers.posti._HTTP2_CLIENT")
+def test_get_locations_http2(mock_client, mock_session):
+    mock_client.get.return_value = locations_response([LOCATION])
+    locations = get_locations(zipcode="20100")
+    assert locations[0]["type"] == "POSTOFFICE"
+    mock_client.get.assert_called_once_with(LOCATION_SERVICE_API_ENDPOINT, params={"zipCode": "20100"})
+    assert not mock_session.get.called
+
+
+def test_http2_disabled_by_default():
+    assert posti._HTTP2_CLIENT is None
+
+
+def test_use_http2():
+    httpx = pytest.importorskip("httpx")
+    pytest.importorskip("h2")
+    try:
+        use_http2()
+        assert isinstance(posti._HTTP2_CLIENT, httpx.Client)
+        pool = posti._HTTP2_CLIENT._transport._pool
+        assert pool._max_connections == 20
+        assert pool._max_keepalive_connections == 4
+    finally:
+        use_http2(False)
+    assert posti._HTTP2_CLIENT is None
+
+
+def test_set_session_closes_http2_client():
+    client = Mock()
+    with patch("smartship.carriers.posti._HTTP2_CLIENT", client), patch("smartship.carriers.posti._SESSION"):
+        set_session(Mock())
+        assert posti._HTTP2_CLIENT is None
+    client.close.assert_called_once_with()
+
+
+@patch.dict(sys.modules, {"httpx": None})
+def test_use_http2_without_httpx():
+    with raises(ImportError):
+        use_http2()
+    assert posti._HTTP2_CLIENT is None
+
+
+@patch("smartship.carriers.posti.orjson", None)
+@patch("smartship.carriers.posti._SESSION.get", return_value=locations_response([LOCATION]))
+def test_get_locations_without_orjson(mock_get):
+    locations = get_locations(zipcode="20100")
+    assert locations.get_json() == [LOCATION]
+
+
+def test_get_locations_bulk_partial_failure():
+    def get(url, params, timeout):
+        if params["zipCode"] == "00000":
+            raise requests.ConnectionError("Connection failed")
+        return locations_response([dict(LOCATION, postalCode=params["zipCode"])])
+
+    with patch("smartship.carriers.posti._SESSION.get", side_effect=get) as mock_get:
+        with raises(requests.ConnectionError):
+            get_locations_bulk([{"zipcode": "20100"}, {"zipcode": "00000"}, {"zipcode": "33100"}])
+        mock_get.reset_mock()
+        # The successful lookups were cached
+        assert get_locations(zipcode="20100")[0]["postalCode"] == "20100"
+        assert get_locations(zipcode="33100")[0]["postalCode"] == "33100"
+        assert not mock_get.called
 
 
 def test_additional_services():
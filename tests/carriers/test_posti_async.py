@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import asyncio
+import gc
+
+import pytest
+from mock import AsyncMock, MagicMock, patch
+
+from smartship.carriers.posti import (
+    LOCATION_SERVICE_API_ENDPOINT, LOCATION_SERVICE_HEADERS)
+
+web = pytest.importorskip("aiohttp.web")
+test_utils = pytest.importorskip("aiohttp.test_utils")
+posti_async = pytest.importorskip("smartship.carriers.posti_async")
+
+LOCATION = {"id": "295", "type": "POSTOFFICE", "postalCode": "20100"}
+
+
+@pytest.fixture
+def mock_session():
+    session = MagicMock()
+    response = session.get.return_value.__aenter__.return_value
+    response.raise_for_status = MagicMock()
+    response.json = AsyncMock(return_value={"locations": [LOCATION]})
+    with patch("smartship.carriers.posti_async._get_session", AsyncMock(return_value=session)):
+        yield session
+
+
+def test_get_locations_async(mock_session):
+    locations = asyncio.run(posti_async.get_locations_async(zipcode="20100", types=["POSTOFFICE", "LOCKER"]))
+    assert locations[0]["type"] == "POSTOFFICE"
+    mock_session.get.assert_called_once_with(
+        LOCATION_SERVICE_API_ENDPOINT,
+        params=[("types", "POSTOFFICE"), ("types", "LOCKER"), ("zipCode", "20100")],
+    )
+
+
+def test_get_locations_async_cached(mock_session):
+    asyncio.run(posti_async.get_locations_async(zipcode="20100"))
+    asyncio.run(posti_async.get_locations_async(zipcode="20100"))
+    assert mock_session.get.call_count == 1
+    asyncio.run(posti_async.get_locations_async(zipcode="20100", use_cache=False))
+    assert mock_session.get.call_count == 2
+
+
+def test_close_async_session():
+    async def open_and_close():
+        session = await posti_async._get_session()
+        await posti_async.close_async_session()
+        return session
+
+    session = asyncio.run(open_and_close())
+    assert session.closed
+    assert posti_async._AIO_SESSION is None
+
+
+async def get_locations_from_local_server(zipcode, close_session=False):
+    async def handler(request):
+        location = dict(LOCATION, postalCode=request.query["zipCode"], userAgent=request.headers["User-Agent"])
+        return web.json_response({"locations": [location]})
+
+    app = web.Application()
+    app.router.add_get("/location", handler)
+    server = test_utils.TestServer(app)
+    await server.start_server()
+    try:
+        with patch("smartship.carriers.posti_async.LOCATION_SERVICE_API_ENDPOINT", str(server.make_url("/location"))):
+            return await posti_async.get_locations_async(zipcode=zipcode, use_cache=False)
+    finally:
+        if close_session:
+            await posti_async.close_async_session()
+        await server.close()
+
+
+@pytest.mark.filterwarnings("error")
+def test_get_locations_async_in_separate_event_loops():
+    assert asyncio.run(get_locations_from_local_server("20100"))[0]["postalCode"] == "20100"
+    locations = asyncio.run(get_locations_from_local_server("00120", close_session=True))
+    assert locations[0]["postalCode"] == "00120"
+    assert locations[0]["userAgent"] == LOCATION_SERVICE_HEADERS["User-Agent"]
+    # The session of the first event loop was released without warnings about unclosed sessions
+    gc.collect()
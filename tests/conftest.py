@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import sys
 from decimal import Decimal
 
 import pytest
 from mock import Mock
 
 from smartship import Client
+from smartship.carriers.posti import get_locations
 from smartship.objects import (
     Agent, Parcels, PDFConfig, Receiver, Sender, SenderPartners, Service)
 from smartship.shipments import Shipment
 
+# The asyncio interface and its tests need Python 3.8+ (async syntax and AsyncMock)
+collect_ignore = ["carriers/test_posti_async.py"] if sys.version_info < (3, 8) else []
+
 
 @pytest.fixture
 def simple_shipment():
@@ -119,3 +124,10 @@ def no_requests(monkeypatch):
             pass
 
     monkeypatch.setattr("requests.get", Mock(return_value=MockResponse))
+    monkeypatch.setattr("requests.Session.get", Mock(return_value=MockResponse))
+
+
+@pytest.fixture(autouse=True)
+def clear_locations_cache():
+    """Start each test with an empty locations cache."""
+    get_locations.cache_clear()
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from smartship.objects import Agent
+from mock import Mock
+
+from smartship.objects import Agent, JSONObject, LazySchema
 
 
 def test_repr():
@@ -14,3 +16,16 @@ def test_repr():
     data = agent.get_json()
     new_agent = eval(repr(agent))
     assert data == new_agent.get_json()
+
+
+def test_lazy_schema():
+    factory = Mock(return_value={"type": "object"})
+
+    class LazyObject(JSONObject):
+        schema = LazySchema(factory)
+
+    assert not factory.called
+    LazyObject({"foo": "bar"})
+    LazyObject({"foo": "baz"})
+    assert LazyObject.schema == {"type": "object"}
+    factory.assert_called_once_with()